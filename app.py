@@ -18,18 +18,29 @@
 """Graph metrics exporter logic for the Thoth project."""
 
 import os
+import functools
 import logging
-from datetime import datetime, timedelta
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, timezone
 from enum import Enum
+from importlib.metadata import version
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import click
 from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
+from prometheus_client.core import GaugeMetricFamily
 
-from thoth.common import init_logging
-from thoth.storages import GraphDatabase, GraphBackupStore
-from thoth.storages import __version__ as __storages_version__
-from thoth.common import __version__ as __common_version__
+if TYPE_CHECKING:
+    # Imported for annotations only: thoth-storages pulls in the whole database stack and is imported only when tasks
+    # run, requests is imported only when metrics are pushed.
+    import requests
+    from thoth.storages import GraphDatabase, GraphBackupStore
 
+__storages_version__ = version("thoth-storages")
+__common_version__ = version("thoth-common")
 
 __version__ = "0.6.5"
 __service_version__ = f"{__version__}+common.{__common_version__}.storages.{__storages_version__}"
@@ -40,10 +51,27 @@ COMPONENT_NAME = "graph-metrics-exporter"
 
 # metrics
 PROMETHEUS_REGISTRY = CollectorRegistry()
-THOTH_METRICS_PUSHGATEWAY_URL = os.environ["PROMETHEUS_PUSHGATEWAY_URL"]
-THOTH_DEPLOYMENT_NAME = os.environ["THOTH_DEPLOYMENT_NAME"]
+
+_REQUIRED_ENV = ("PROMETHEUS_PUSHGATEWAY_URL", "THOTH_DEPLOYMENT_NAME")
+
+_PG_DUMP_PREFIX_LEN = len("pg_dump-")
 
 GRAPH_BACKUP_CHECK_DATE = int(os.getenv("THOTH_GRAPH_BACKUP_CHECK_DAYS", 7))
+PUSHGATEWAY_TIMEOUT = int(os.getenv("THOTH_PUSHGATEWAY_TIMEOUT", 10))
+# Tables reported in bloat data metrics, all tables are reported if not set.
+TRACKED_TABLES = frozenset(table for table in os.getenv("THOTH_TRACKED_TABLES", "").split(",") if table)
+EXPECTED_ALEMBIC_REVISION = os.getenv("THOTH_EXPECTED_ALEMBIC_REVISION")
+# Run amcheck at most once in the given number of seconds while the database is found not corrupted, 0 to always run.
+AMCHECK_INTERVAL = int(os.getenv("THOTH_AMCHECK_INTERVAL", 0))
+AMCHECK_MARKER_PATH = os.getenv("THOTH_AMCHECK_MARKER_PATH", "/tmp/thoth-graph-metrics-exporter-amcheck")
+
+# psycopg2 connections cannot be shared by concurrently running queries, keep one per thread.
+_GRAPH_LOCAL = threading.local()
+# All the connections opened, so that they can be closed once tasks finish.
+_GRAPHS: List["GraphDatabase"] = []
+_GRAPHS_LOCK = threading.Lock()
+# Names of the tasks that failed, the job fails once all the metrics were pushed.
+_FAILED_TASKS: List[str] = []
 
 
 class TaskEnum(Enum):
@@ -55,250 +83,514 @@ class TaskEnum(Enum):
     DATABASE_DUMPS = "graph_database_dumps_check"
 
 
-init_logging()
+_TASK_VALUES = tuple(entity.value for entity in TaskEnum)
+_CORRUPTION_CHECK = TaskEnum.CORRUPTION_CHECK.value
+_TABLE_BLOAT_DATA = TaskEnum.TABLE_BLOAT_DATA.value
+_INDEX_BLOAT_DATA = TaskEnum.INDEX_BLOAT_DATA.value
+_DATABASE_DUMPS = TaskEnum.DATABASE_DUMPS.value
+
+
+class _RunGauge:
+    """Gauge exposing only the samples gathered in the current run, no stale series are kept across runs."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: CollectorRegistry = PROMETHEUS_REGISTRY,
+    ):
+        """Create the gauge and register it to the given registry."""
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = labelnames
+        self._samples: Optional[List[Tuple[Tuple[str, ...], float]]] = None
+        registry.register(self)
+
+    def set(self, value: float) -> None:
+        """Set the value of a gauge without labels."""
+        self._samples = [((), value)]
+
+    def set_samples(self, samples: List[Tuple[Tuple[str, ...], float]]) -> None:
+        """Set the values of a gauge with labels, given as label values and value pairs."""
+        self._samples = samples
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        """Collect samples set in the current run, nothing is exposed if none were set."""
+        if self._samples is None:
+            return
+
+        metric = GaugeMetricFamily(self._name, self._documentation, labels=self._labelnames)
+        for labels, value in self._samples:
+            metric.add_metric(labels, value)
+
+        yield metric
+
 
 database_schema_revision_script = Gauge(
     "thoth_database_schema_revision_script",
     "Thoth database schema revision from script",
-    ["component", "revision", "env"],
+    ["revision"],
     registry=PROMETHEUS_REGISTRY,
 )
 
-graphdb_is_corrupted = Gauge(
+graphdb_is_corrupted = _RunGauge(
     "thoth_graphdb_is_corrupted",
     "amcheck has detected corruption.",
-    ["env"],
     registry=PROMETHEUS_REGISTRY,
 )
 
-graphdb_pct_bloat_data_table = Gauge(
+graphdb_pct_bloat_data_table = _RunGauge(
     "thoth_graphdb_pct_bloat_data_table",
     "Bloat data (pct_bloat) per table in Thoth Knowledge Graph.",
-    ["table_name", "env"],
+    ["table_name"],
     registry=PROMETHEUS_REGISTRY,
 )
 
-graphdb_mb_bloat_data_table = Gauge(
+graphdb_mb_bloat_data_table = _RunGauge(
     "thoth_graphdb_mb_bloat_data_table",
     "Bloat data (mb_bloat) per table in Thoth Knowledge Graph.",
-    ["table_name", "env"],
+    ["table_name"],
     registry=PROMETHEUS_REGISTRY,
 )
 
-graphdb_pct_index_bloat_data_table = Gauge(
+graphdb_pct_index_bloat_data_table = _RunGauge(
     "thoth_graphdb_pct_index_bloat_data_table",
     "Index Bloat data (bloat_pct) per table in Thoth Knowledge Graph.",
-    ["table_name", "index_name", "env"],
+    ["table_name", "index_name"],
     registry=PROMETHEUS_REGISTRY,
 )
 
-graphdb_mb_index_bloat_data_table = Gauge(
+graphdb_mb_index_bloat_data_table = _RunGauge(
     "thoth_graphdb_mb_index_bloat_data_table",
     "Index Bloat data (bloat_mb) per table in Thoth Knowledge Graph.",
-    ["table_name", "index_name", "env"],
+    ["table_name", "index_name"],
     registry=PROMETHEUS_REGISTRY,
 )
 
 # Expose number of dumps available
-graphdb_dump_count = Gauge(
+graphdb_dump_count = _RunGauge(
     "thoth_graphdb_dump_count",
     "Number of pg dumps stored on Ceph.",
-    ["env"],
     registry=PROMETHEUS_REGISTRY,
 )
 
 # Expose last dump
-graphdb_last_dump = Gauge(
-    "thoth_graphdb_last_dump",
-    "Last dump date stored on Ceph.",
-    ["date", "env"],
+graphdb_last_dump_timestamp_seconds = _RunGauge(
+    "thoth_graphdb_last_dump_timestamp_seconds",
+    "Date of the last dump stored on Ceph, as seconds since the epoch.",
     registry=PROMETHEUS_REGISTRY,
 )
 
 # Check if dumps are not correctly cleaned
-graphdb_dump_not_cleaned = Gauge(
+graphdb_dump_not_cleaned = _RunGauge(
     "thoth_graphdb_dump_not_cleaned",
     "Check if the number of dumps on Ceph is higher than expected.",
-    ["env"],
     registry=PROMETHEUS_REGISTRY,
 )
 
 # Check if last expected dump is missing
-graphdb_dump_missed = Gauge(
+graphdb_dump_missed = _RunGauge(
     "thoth_graphdb_dump_missed",
     "Check if the last expected dump is missing.",
-    ["env"],
     registry=PROMETHEUS_REGISTRY,
 )
 
+# Check if the connection to the database failed
+graphdb_connection_failed = _RunGauge(
+    "thoth_graphdb_connection_failed",
+    "Check if the connection to Thoth Knowledge Graph failed.",
+    registry=PROMETHEUS_REGISTRY,
+)
+
+# Check if a task failed to collect its metrics
+graph_metrics_exporter_task_failed = Gauge(
+    "thoth_graph_metrics_exporter_task_failed",
+    "Check if the task failed to collect its metrics.",
+    ["task"],
+    registry=PROMETHEUS_REGISTRY,
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_required_env() -> Dict[str, str]:
+    """Get the required environment variables, read lazily so that the command line can be parsed without them."""
+    config = {name: os.getenv(name) for name in _REQUIRED_ENV}
+    missing = [name for name, value in config.items() if value is None]
+    if missing:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+
+    return config
+
+
+def _get_timeout_env(name: str, default: int) -> int:
+    """Get a timeout in seconds or milliseconds from the environment, failing on malformed values."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+
+    try:
+        timeout = int(value)
+    except ValueError:
+        timeout = -1
+
+    if timeout < 0:
+        raise ValueError(f"Environment variable {name} must be a non-negative integer, got {value!r}")
+
+    return timeout
+
+
+def _configure_graph_connection() -> None:
+    """Bound the graph database connection, it is created by thoth-storages so libpq environment variables are used."""
+    connect_timeout = _get_timeout_env("THOTH_GRAPH_CONNECT_TIMEOUT", 10)
+    statement_timeout = _get_timeout_env("THOTH_GRAPH_STATEMENT_TIMEOUT", 0)
+
+    os.environ.setdefault("PGCONNECT_TIMEOUT", str(connect_timeout))
+    if statement_timeout:
+        os.environ.setdefault("PGOPTIONS", f"-c statement_timeout={statement_timeout}")
+
+
+def _get_graph() -> "GraphDatabase":
+    """Get the graph database of the current thread, connecting to it on first use."""
+    graph = getattr(_GRAPH_LOCAL, "graph", None)
+    if graph is None:
+        from thoth.storages import GraphDatabase
+
+        graph = GraphDatabase()
+        try:
+            graph.connect()
+        except Exception:
+            graphdb_connection_failed.set(1)
+            raise
+
+        _GRAPH_LOCAL.graph = graph
+        with _GRAPHS_LOCK:
+            _GRAPHS.append(graph)
+
+    return graph
+
+
+def _disconnect_graphs() -> None:
+    """Disconnect all the graph databases opened by any thread."""
+    with _GRAPHS_LOCK:
+        while _GRAPHS:
+            _GRAPHS.pop().disconnect()
+
+    _GRAPH_LOCAL.graph = None
+
+
+@functools.lru_cache(maxsize=1)
+def _get_alembic_version_head() -> str:
+    """Get the alembic revision head of the database schema scripts, it does not change during a run."""
+    # The revision is known at deployment time, look it up only if it was not provided.
+    return EXPECTED_ALEMBIC_REVISION or _get_graph().get_script_alembic_version_head()
+
 
 def _create_common_metrics():
     """Create common metrics to pushgateway."""
-    database_schema_revision_script.labels(
-        COMPONENT_NAME, GraphDatabase().get_script_alembic_version_head(), THOTH_DEPLOYMENT_NAME
-    ).inc()
+    database_schema_revision_script.labels(_get_alembic_version_head()).inc()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_pushgateway_session() -> "requests.Session":
+    """Get the HTTP session keeping the connection to pushgateway alive across pushes, created on first use."""
+    import requests
+
+    return requests.Session()
+
+
+def _pushgateway_handler(url, method, timeout, headers, data):
+    """Handle pushgateway requests using the persistent HTTP session."""
+
+    def handle():
+        response = _get_pushgateway_session().request(method, url, data=data, headers=dict(headers), timeout=timeout)
+        response.raise_for_status()
+
+    return handle
 
 
 def _send_metrics():
-    """Send metrics to pushgateway."""
+    """Send metrics to pushgateway.
+
+    All the metrics gathered by the tasks are pushed in one request, this is meant to be called once per run.
+    """
+    if not any(metric.samples for metric in PROMETHEUS_REGISTRY.collect()):
+        _LOGGER.debug("No metrics were gathered, nothing to submit to Prometheus pushgateway")
+        return
+
+    config = _get_required_env()
+    pushgateway_url = config["PROMETHEUS_PUSHGATEWAY_URL"]
     try:
-        _LOGGER.debug(f"Submitting metrics to Prometheus pushgateway {THOTH_METRICS_PUSHGATEWAY_URL}")
+        _LOGGER.debug("Submitting metrics to Prometheus pushgateway %s", pushgateway_url)
         push_to_gateway(
-            THOTH_METRICS_PUSHGATEWAY_URL,
+            pushgateway_url,
             job=COMPONENT_NAME,
             registry=PROMETHEUS_REGISTRY,
+            # Labels shared by all the metrics are attached once to the whole group.
+            grouping_key={"component": COMPONENT_NAME, "env": config["THOTH_DEPLOYMENT_NAME"]},
+            timeout=PUSHGATEWAY_TIMEOUT,
+            handler=_pushgateway_handler,
         )
     except Exception as e:
-        _LOGGER.exception(f"An error occurred pushing the metrics: {str(e)}")
+        _LOGGER.exception("An error occurred pushing the metrics: %s", e)
 
 
-def _graph_corruption_check(graph: GraphDatabase):
+def _run_task(task_name: str, task_func: Callable[[], None]) -> None:
+    """Run the given task, recording if it failed."""
+    try:
+        task_func()
+    except Exception as e:
+        _LOGGER.exception("Task %s failed: %s", task_name, e)
+        graph_metrics_exporter_task_failed.labels(task_name).set(1)
+        _FAILED_TASKS.append(task_name)
+    else:
+        graph_metrics_exporter_task_failed.labels(task_name).set(0)
+
+
+def _run_graph_task(task_name: str, task_func: Callable[["GraphDatabase"], None]) -> None:
+    """Run the given task on the database connection of the current thread, recording if it failed."""
+    _run_task(task_name, lambda: task_func(_get_graph()))
+
+
+def _amcheck_recently_passed() -> bool:
+    """Check if amcheck found the database not corrupted within the configured interval."""
+    if not AMCHECK_INTERVAL:
+        return False
+
+    try:
+        last_passed = os.path.getmtime(AMCHECK_MARKER_PATH)
+    except OSError:
+        return False
+
+    return time.time() - last_passed < AMCHECK_INTERVAL
+
+
+def _graph_corruption_check(graph: "GraphDatabase"):
+    if _amcheck_recently_passed():
+        _LOGGER.info("Graph database was recently found not corrupted, skipping amcheck.")
+        graphdb_is_corrupted.set(0)
+        return
+
     if graph.is_database_corrupted():
         _LOGGER.info("Graph database is corrupted!")
-        graphdb_is_corrupted.labels(THOTH_DEPLOYMENT_NAME).set(1)
+        graphdb_is_corrupted.set(1)
     else:
         _LOGGER.info("Graph database is not corrupted.")
-        graphdb_is_corrupted.labels(THOTH_DEPLOYMENT_NAME).set(0)
+        graphdb_is_corrupted.set(0)
 
+        if AMCHECK_INTERVAL:
+            try:
+                Path(AMCHECK_MARKER_PATH).touch()
+            except OSError as e:
+                # The check itself passed, amcheck will just be run again next time.
+                _LOGGER.warning("Failed to record amcheck marker %s: %s", AMCHECK_MARKER_PATH, e)
 
-def _graph_table_bloat_data(graph: GraphDatabase):
-    bloat_data = graph.get_bloat_data()
 
-    if bloat_data:
-        for table_data in bloat_data:
-            graphdb_pct_bloat_data_table.labels(table_data["tablename"], THOTH_DEPLOYMENT_NAME).set(
-                table_data["pct_bloat"]
-            )
-            _LOGGER.info(
-                "thoth_graphdb_pct_bloat_data_table(%r, %r)=%r",
-                table_data["tablename"],
-                THOTH_DEPLOYMENT_NAME,
-                table_data["pct_bloat"],
-            )
+def _graph_table_bloat_data(graph: "GraphDatabase"):
+    bloat_data = graph.get_bloat_data()
 
-            graphdb_mb_bloat_data_table.labels(table_data["tablename"], THOTH_DEPLOYMENT_NAME).set(
-                table_data["mb_bloat"]
-            )
-            _LOGGER.info(
-                "thoth_graphdb_mb_bloat_data_table(%r, %r)=%r",
-                table_data["tablename"],
-                THOTH_DEPLOYMENT_NAME,
+    log_debug = _LOGGER.isEnabledFor(logging.DEBUG)
+    tracked_tables = TRACKED_TABLES
+    pct_samples = []
+    mb_samples = []
+    max_pct_bloat = 0
+    for table_data in bloat_data:
+        if tracked_tables and table_data["tablename"] not in tracked_tables:
+            continue
+
+        labels = (table_data["tablename"],)
+        pct_bloat = table_data["pct_bloat"]
+        if pct_bloat > max_pct_bloat:
+            max_pct_bloat = pct_bloat
+
+        pct_samples.append((labels, pct_bloat))
+        mb_samples.append((labels, table_data["mb_bloat"]))
+        if log_debug:
+            _LOGGER.debug(
+                "thoth_graphdb_pct_bloat_data_table(%r)=%r, thoth_graphdb_mb_bloat_data_table(%r)=%r",
+                *labels,
+                pct_bloat,
+                *labels,
                 table_data["mb_bloat"],
             )
+
+    if pct_samples:
+        _LOGGER.info("Bloat data exported for %d tables, the highest pct_bloat is %r", len(pct_samples), max_pct_bloat)
     else:
-        graphdb_pct_bloat_data_table.labels("No table pct", THOTH_DEPLOYMENT_NAME).set(0)
+        pct_samples.append((("No table pct",), 0))
         _LOGGER.info("thoth_graphdb_pct_bloat_data_table is empty")
 
-        graphdb_mb_bloat_data_table.labels("No table mb", THOTH_DEPLOYMENT_NAME).set(0)
+        mb_samples.append((("No table mb",), 0))
         _LOGGER.info("thoth_graphdb_mb_bloat_data_table is empty")
 
+    graphdb_pct_bloat_data_table.set_samples(pct_samples)
+    graphdb_mb_bloat_data_table.set_samples(mb_samples)
 
-def _graph_index_bloat_data(graph: GraphDatabase):
-    index_bloat_data = graph.get_index_bloat_data()
 
-    if index_bloat_data:
-        for table_data in index_bloat_data:
-            graphdb_pct_index_bloat_data_table.labels(
-                table_data["table_name"], table_data["index_name"], THOTH_DEPLOYMENT_NAME
-            ).set(table_data["bloat_pct"])
-            _LOGGER.info(
-                "thoth_graphdb_pct_index_bloat_data_table(%r, %r, %r)=%r",
-                table_data["table_name"],
-                table_data["index_name"],
-                THOTH_DEPLOYMENT_NAME,
-                table_data["bloat_pct"],
-            )
+def _graph_index_bloat_data(graph: "GraphDatabase"):
+    index_bloat_data = graph.get_index_bloat_data()
 
-            graphdb_mb_index_bloat_data_table.labels(
-                table_data["table_name"], table_data["index_name"], THOTH_DEPLOYMENT_NAME
-            ).set(table_data["bloat_mb"])
-            _LOGGER.info(
-                "thoth_graphdb_mb_index_bloat_data_table(%r, %r, %r)=%r",
-                table_data["table_name"],
-                table_data["index_name"],
-                THOTH_DEPLOYMENT_NAME,
+    log_debug = _LOGGER.isEnabledFor(logging.DEBUG)
+    tracked_tables = TRACKED_TABLES
+    pct_samples = []
+    mb_samples = []
+    max_bloat_pct = 0
+    for table_data in index_bloat_data:
+        if tracked_tables and table_data["table_name"] not in tracked_tables:
+            continue
+
+        labels = (table_data["table_name"], table_data["index_name"])
+        bloat_pct = table_data["bloat_pct"]
+        if bloat_pct > max_bloat_pct:
+            max_bloat_pct = bloat_pct
+
+        pct_samples.append((labels, bloat_pct))
+        mb_samples.append((labels, table_data["bloat_mb"]))
+        if log_debug:
+            _LOGGER.debug(
+                "thoth_graphdb_pct_index_bloat_data_table(%r, %r)=%r, "
+                "thoth_graphdb_mb_index_bloat_data_table(%r, %r)=%r",
+                *labels,
+                bloat_pct,
+                *labels,
                 table_data["bloat_mb"],
             )
+
+    if pct_samples:
+        _LOGGER.info(
+            "Index bloat data exported for %d indexes, the highest bloat_pct is %r", len(pct_samples), max_bloat_pct
+        )
     else:
-        graphdb_pct_index_bloat_data_table.labels("No table pct", THOTH_DEPLOYMENT_NAME).set(0)
+        pct_samples.append((("No table pct", "No index pct"), 0))
         _LOGGER.info("thoth_graphdb_pct_index_bloat_data_table is empty")
 
-        graphdb_mb_index_bloat_data_table.labels("No table mb", THOTH_DEPLOYMENT_NAME).set(0)
+        mb_samples.append((("No table mb", "No index mb"), 0))
         _LOGGER.info("thoth_graphdb_mb_index_bloat_data_table is empty")
 
+    graphdb_pct_index_bloat_data_table.set_samples(pct_samples)
+    graphdb_mb_index_bloat_data_table.set_samples(mb_samples)
 
-def _graph_database_dumps(adapter: GraphBackupStore) -> None:
-    pg_dumps = []
+
+def _graph_database_dumps(adapter: "GraphBackupStore") -> None:
+    from thoth.storages import GraphBackupStore
+
+    pg_dumps_number = 0
+    last_dump = ""
     for pg_dump in adapter.get_document_listing():
-        pg_dumps.append(
-            datetime.strptime(pg_dump[len("pg_dump-") :], GraphBackupStore._BACKUP_FILE_DATETIME_FORMAT).date()
-        )
+        pg_dumps_number += 1
+        # Dump names embed a zero padded year first date so they sort chronologically.
+        if pg_dump > last_dump:
+            last_dump = pg_dump
 
-    pg_dumps_number = len(pg_dumps)
-    graphdb_dump_count.labels(THOTH_DEPLOYMENT_NAME).set(pg_dumps_number)
+    graphdb_dump_count.set(pg_dumps_number)
     _LOGGER.info(f"Number of database dumps available on Ceph is: {pg_dumps_number}")
 
     pg_dumps_expected = GraphBackupStore.GRAPH_BACKUP_STORE_ROTATE
     _LOGGER.info(f"Number of database dumps expected: {pg_dumps_expected}")
 
-    if pg_dumps_number > pg_dumps_expected:
-        graphdb_dump_not_cleaned.labels(THOTH_DEPLOYMENT_NAME).set(1)
-    else:
-        graphdb_dump_not_cleaned.labels(THOTH_DEPLOYMENT_NAME).set(0)
+    graphdb_dump_not_cleaned.set(int(pg_dumps_number > pg_dumps_expected))
+
+    if not pg_dumps_number:
+        _LOGGER.warning("No database dumps available on Ceph")
+        graphdb_dump_missed.set(1)
+        return
 
     #  Consider only last uploaded pg dump
-    last_dump_date = max(pg_dumps)
+    last_dump_date = datetime.strptime(
+        last_dump[_PG_DUMP_PREFIX_LEN:], GraphBackupStore._BACKUP_FILE_DATETIME_FORMAT
+    ).date()
 
     _LOGGER.info(f"Last database dump was stored on: {last_dump_date}")
-    graphdb_last_dump.labels(date=last_dump_date, env=THOTH_DEPLOYMENT_NAME).inc()
+    graphdb_last_dump_timestamp_seconds.set(
+        datetime.combine(last_dump_date, datetime.min.time(), tzinfo=timezone.utc).timestamp()
+    )
 
-    last_expected_dump_date = datetime.utcnow().date() - timedelta(days=GRAPH_BACKUP_CHECK_DATE)
+    last_expected_dump_ordinal = datetime.now(timezone.utc).toordinal() - GRAPH_BACKUP_CHECK_DATE
 
-    _LOGGER.info(f"Last expected database dump date is: {last_expected_dump_date}")
+    _LOGGER.info(f"Last expected database dump date is: {date.fromordinal(last_expected_dump_ordinal)}")
 
-    if last_dump_date < last_expected_dump_date:
-        graphdb_dump_missed.labels(THOTH_DEPLOYMENT_NAME).set(1)
-    else:
-        graphdb_dump_missed.labels(THOTH_DEPLOYMENT_NAME).set(0)
+    graphdb_dump_missed.set(int(last_dump_date.toordinal() < last_expected_dump_ordinal))
+
+
+def _graph_database_dumps_check() -> None:
+    from thoth.storages import GraphBackupStore
+
+    adapter = GraphBackupStore()
+    adapter.connect()
+    _graph_database_dumps(adapter=adapter)
 
 
 @click.command()
-@click.option(
-    "--task", "-t", type=click.Choice([entity.value for entity in TaskEnum], case_sensitive=False), required=False
-)
+@click.option("--task", "-t", type=click.Choice(_TASK_VALUES, case_sensitive=False), required=False)
 def main(task):
     """Run log running task on the database for graph metrics exporter."""
+    from thoth.common import init_logging
+
+    init_logging()
+    _LOGGER.info("graph-metrics-exporter  v%s starting...", __service_version__)
     _LOGGER.debug("Debug mode is on.")
 
-    _create_common_metrics()
+    # Fail before doing any work if the configuration is incomplete or malformed.
+    _get_required_env()
+    _configure_graph_connection()
 
     if task:
         _LOGGER.info(f"{task} task starting...")
     else:
         _LOGGER.info("No specific task selected, all tasks will be run...")
 
-    graph = GraphDatabase()
-    graph.connect()
-
-    adapter = GraphBackupStore()
-    adapter.connect()
+    graph_tasks: List[Tuple[str, Callable[["GraphDatabase"], None]]] = [
+        (_CORRUPTION_CHECK, _graph_corruption_check),
+        (_TABLE_BLOAT_DATA, _graph_table_bloat_data),
+        (_INDEX_BLOAT_DATA, _graph_index_bloat_data),
+    ]
+    graph_tasks = [(task_name, task_func) for task_name, task_func in graph_tasks if task == task_name or not task]
+    run_database_dumps = task == _DATABASE_DUMPS or not task
 
-    if task == TaskEnum.CORRUPTION_CHECK.value or not task:
-        _graph_corruption_check(graph=graph)
+    connection_error = None
+    try:
+        _get_graph()
+    except Exception as e:
+        # The database dumps check does not use the database, it is still run and its failure is reported as well.
+        _LOGGER.exception("Failed to connect to the graph database: %s", e)
+        connection_error = e
+        graph_tasks = []
+    else:
+        graphdb_connection_failed.set(0)
 
-    if task == TaskEnum.TABLE_BLOAT_DATA.value or not task:
-        _graph_table_bloat_data(graph=graph)
+    try:
+        if connection_error is None:
+            _create_common_metrics()
+
+        # Tasks are I/O bound on the database and Ceph, run them concurrently to reduce the overall wall time. The
+        # first graph task runs in this thread so that it reuses the connection already opened.
+        with ThreadPoolExecutor(max_workers=max(len(graph_tasks) - 1 + run_database_dumps, 1)) as executor:
+            futures = [
+                executor.submit(_run_graph_task, task_name, task_func) for task_name, task_func in graph_tasks[1:]
+            ]
+            if run_database_dumps:
+                futures.append(executor.submit(_run_task, _DATABASE_DUMPS, _graph_database_dumps_check))
+
+            if graph_tasks:
+                _run_graph_task(*graph_tasks[0])
+
+            wait(futures)
+    finally:
+        _disconnect_graphs()
+
+    # Tasks only update the registry, metrics are pushed once all of them finished.
+    _send_metrics()
 
-    if task == TaskEnum.INDEX_BLOAT_DATA.value or not task:
-        _graph_index_bloat_data(graph=graph)
+    # A failed database dumps check is reported even if the graph database was unreachable, the connection error
+    # was already logged.
+    if _FAILED_TASKS:
+        raise click.ClickException(f"Tasks failed: {', '.join(_FAILED_TASKS)}") from connection_error
 
-    if task == TaskEnum.DATABASE_DUMPS.value or not task:
-        _graph_database_dumps(adapter=adapter)
+    if connection_error is not None:
+        raise connection_error
 
-    _send_metrics()
     _LOGGER.info("Graph metrics exporter finished.")
 
 
 if __name__ == "__main__":
-    _LOGGER.info("graph-metrics-exporter  v%s starting...", __service_version__)
     main(auto_envvar_prefix="THOTH_GRAPH_METRICS_EXPORTER")